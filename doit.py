@@ -8,50 +8,352 @@ Date: 19-03-2024
 '''
 
 import argparse
-from subprocess import run
-from os.path import realpath, join
+import select
+import signal
+import sys
+from os import (
+    PathLike, chdir, close, environ, execvpe, fsencode, makedirs, replace,
+    scandir, stat,
+)
+from os.path import realpath, join, dirname, isfile, expanduser
+from subprocess import CalledProcessError, Popen, run
+
+try:
+    # Linux only
+    from os import pidfd_open
+except ImportError:
+    pidfd_open = None
 
 
 # Base utility commands
-ANSIBLE_LINT_CMD = ['ansible-lint']
-ANSIBLE_VAULT_CMD = ['ansible-vault']
-VAGRANT_DESTROY_CMD = ['vagrant', 'destroy']
-VAGRANT_REPROVISION_CMD = ['vagrant', 'provision']
-VAGRANT_SSH_CMD = ['vagrant', 'ssh']
-VAGRANT_STATUS_CMD = ['vagrant', 'status']
-VAGRANT_UP_CMD = ['vagrant', 'up']
-VAGRANT_VALIDATE_CMD = ['vagrant', 'validate']
+ANSIBLE_GALAXY_CMD = ('ansible-galaxy', 'install', '-r')
+ANSIBLE_LINT_CMD = ('ansible-lint',)
+ANSIBLE_PLAYBOOK_CMD = ('ansible-playbook', '--ask-vault-pass')
+ANSIBLE_VAULT_CMD = ('ansible-vault',)
+VAGRANT_DESTROY_CMD = ('vagrant', 'destroy')
+VAGRANT_REPROVISION_CMD = ('vagrant', 'provision')
+VAGRANT_SSH_CMD = ('vagrant', 'ssh')
+VAGRANT_SSH_CONFIG_CMD = ('vagrant', 'ssh-config')
+VAGRANT_STATUS_CMD = ('vagrant', 'status')
+VAGRANT_UP_CMD = ('vagrant', 'up', '--parallel')
+VAGRANT_VALIDATE_CMD = ('vagrant', 'validate')
+
+# Descriptions of the subcommands, shown by --help
+_VAGRANT_UP_STR = ' '.join(VAGRANT_UP_CMD)
+_VAGRANT_STATUS_STR = ' '.join(VAGRANT_STATUS_CMD)
+_VAGRANT_SSH_STR = ' '.join(VAGRANT_SSH_CMD)
+_VAGRANT_REPROVISION_STR = ' '.join(VAGRANT_REPROVISION_CMD)
+_VAGRANT_DESTROY_STR = ' '.join(VAGRANT_DESTROY_CMD)
+_VAGRANT_VALIDATE_STR = ' '.join(VAGRANT_VALIDATE_CMD)
+_ANSIBLE_LINT_STR = ' '.join(ANSIBLE_LINT_CMD)
+_ANSIBLE_VAULT_STR = ' '.join(ANSIBLE_VAULT_CMD)
+
+DESC_SETUP = f'Create and provision a virtual machine ({_VAGRANT_UP_STR}).'
+DESC_STATUS = f'Show the status of virtual machine ({_VAGRANT_STATUS_STR}).'
+DESC_ENTER = (
+    f'Open an SSH connection to virtual machine ({_VAGRANT_SSH_STR}).'
+)
+DESC_REPROVISION = (
+    f'(Re)Provision an existing virtual machine ({_VAGRANT_REPROVISION_STR}).'
+)
+DESC_DESTROY = f'Destroy running virtual machine ({_VAGRANT_DESTROY_STR}).'
+DESC_VALIDATE = 'Validate Vagrantfile and Ansible Playbook.'
+DESC_VALIDATE_VAGRANT = f'Validate Vagrantfile ({_VAGRANT_VALIDATE_STR}).'
+DESC_VALIDATE_PLAYBOOK = f'Validate Ansible Playbook ({_ANSIBLE_LINT_STR}).'
+DESC_ENCRYPT_VAULT = (
+    f'Encrypt a file with Ansible Vault ({_ANSIBLE_VAULT_STR}).'
+)
+DESC_EDIT_VAULT = (
+    f'Edit a file encrypted by Ansible Vault ({_ANSIBLE_VAULT_STR}).'
+)
+DESC_VIEW_VAULT = (
+    'Show the content of a file encrypted by Ansible Vault '
+    f'({_ANSIBLE_VAULT_STR}).'
+)
+DESC_REKEY_VAULT = (
+    'Change the key used to encrypt a file using Ansible Vault '
+    f'({_ANSIBLE_VAULT_STR}).'
+)
+
+# Where doit.py keeps data between runs
+CACHE_DIR = join(expanduser('~'), '.cache', 'doit')
+ANSIBLE_LINT_CACHE_DIR = join(CACHE_DIR, 'ansible-lint')
+# Configuration files ansible-lint looks for in the project directory
+# https://ansible.readthedocs.io/projects/lint/configuring/
+ANSIBLE_LINT_CONFIG_FILES = (
+    '.ansible-lint', '.ansible-lint.yml', '.ansible-lint.yaml',
+    join('.config', 'ansible-lint.yml'), join('.config', 'ansible-lint.yaml'),
+)
+
+# Ansible settings for the provisioning runs (setup and reprovision) given
+# --cache-facts, including the ansible-playbook run by Vagrant's provisioner.
+# Facts are cached, so running again within an hour skips gathering them.
+# The cache is kept per Vagrantfile (see fact_cache_path), since Vagrant
+# names the machines the same way (e.g. "default") in every project.
+# Ansible gives these variables priority over ansible.cfg, so they override
+# its gathering and fact_caching* settings. None of them is set if a variable
+# starting with one of FACT_CACHE_VARS is already set in the environment.
+# https://docs.ansible.com/ansible/latest/reference_appendices/config.html
+FACT_CACHE_VARS = ('ANSIBLE_CACHE_PLUGIN', 'ANSIBLE_GATHERING')
+FACT_CACHE_ENV = {
+    'ANSIBLE_CACHE_PLUGIN': 'jsonfile',
+    'ANSIBLE_CACHE_PLUGIN_TIMEOUT': '3600',
+    'ANSIBLE_GATHERING': 'smart',
+}
+
+# Vagrant settings for the commands run by doit.py.
+# Skip the version check Vagrant makes over the network on every command.
+# Variables already set in the environment take precedence.
+# https://developer.hashicorp.com/vagrant/docs/other/environmental-variables
+VAGRANT_ENV = {
+    'VAGRANT_CHECKPOINT_DISABLE': '1',
+}
+
+# Make Python commands (ansible-*) write their output line by line,
+# even when doit.py is piped (e.g. into tee in CI)
+OUTPUT_ENV = {
+    'PYTHONUNBUFFERED': '1',
+}
+
+# Signals ignored by Python, which commands must get back with their default
+# action (as subprocess does with restore_signals=True). Otherwise, e.g.
+# "yes | head -1" in a command complains about a broken pipe
+RESTORED_SIGNALS = tuple(
+    getattr(signal, name) for name in ('SIGPIPE', 'SIGXFSZ')
+    if hasattr(signal, name)
+)
+
+# Mitogen strategy plugin
+# https://mitogen.networkgenomics.com/ansible_detailed.html
+# Its directory is relative to the path where Mitogen was extracted
+MITOGEN_STRATEGY = 'mitogen_linear'
+MITOGEN_STRATEGY_PLUGINS = join('ansible_mitogen', 'plugins', 'strategy')
+
+# Default paths used by the subcommands, resolved once from the current dir
+_CWD = realpath('.')
+# Default path to the playbook is provisioning/playbook.yml in the current dir
+_DEFAULT_PLAYBOOK = join(_CWD, 'provisioning', 'playbook.yml')
 
 
 ##### Useful functions #####
 
 
-def run_cmd_and_exit(cmd, workdir=None):
+def cmd_env(env=None):
+    '''Return the full environment for a command run by doit.py: the Vagrant
+    and output defaults, then os.environ, then the given variables.
+
+    env - (optional) variables to add to the environment of the command
+    '''
+    return {
+        **VAGRANT_ENV, **OUTPUT_ENV, **environ, **(env or {})
+    }
+
+
+def run_cmd_and_exit(cmd, workdir=None, env=None):
     '''Run a command, wait for it to complete and exit.
     Command can be interactive or non-interactive.
 
     cmd - list of command and arguments to run
     workdir - (optional) change to workdir before executing the command
+    env - (optional) variables to add to the environment of the command
     '''
-    run(cmd, check=True, cwd=workdir)
+    run(cmd, check=True, cwd=workdir, env=cmd_env(env))
+
 
+def run_cmd_and_exec(cmd, workdir=None):
+    '''Replace this process with a command, so it never returns.
+    Use it only for commands that are the last action of a task.
+    Command can be interactive or non-interactive, and it gets signals
+    (like Ctrl-C) directly.
+
+    cmd - list of command and arguments to run
+    workdir - (optional) change to workdir before executing the command
+    '''
+    # Buffered output would be lost when the process image is replaced
+    sys.stdout.flush()
+    sys.stderr.flush()
+    if workdir:
+        chdir(workdir)
+    # Ignored signals would stay ignored in the new process image
+    for signum in RESTORED_SIGNALS:
+        signal.signal(signum, signal.SIG_DFL)
+    execvpe(cmd[0], cmd, cmd_env())
+
+
+def run_cmds_and_exit(cmds):
+    '''Run several non-interactive commands at the same time,
+    wait for all of them to complete and exit.
+    Raise CalledProcessError for the first command that failed.
+
+    cmds - list of (cmd, workdir) pairs, where cmd is a list of command and
+           arguments to run and workdir (may be None) is where to run it
+    '''
+    processes = []
+    try:
+        for cmd, workdir in cmds:
+            processes.append(Popen(cmd, cwd=workdir, env=cmd_env()))
+    finally:
+        # Never leave a started command behind
+        wait_processes(processes)
+
+    for process in processes:
+        if process.returncode:
+            raise CalledProcessError(process.returncode, process.args)
+
+
+def wait_processes(processes):
+    '''Wait for several processes to complete.
+    On Linux, poll their pidfds, so this process wakes up only once each time
+    one of them exits. Elsewhere, wait for each of them in turn.
+
+    processes - list of Popen objects
+    '''
+    pidfds = {}
+    try:
+        if pidfd_open:
+            poller = select.poll()
+            for process in processes:
+                pidfd = pidfd_open(process.pid)
+                pidfds[pidfd] = process
+                poller.register(pidfd, select.POLLIN)
+
+            while pidfds:
+                for pidfd, _ in poller.poll():
+                    poller.unregister(pidfd)
+                    close(pidfd)
+                    # The process has exited, so this only reaps it
+                    pidfds.pop(pidfd).wait()
+    except OSError:
+        # pidfd_open is not supported by the running kernel
+        pass
+    finally:
+        for pidfd in pidfds:
+            close(pidfd)
+
+    for process in processes:
+        process.wait()
+
+
+def fact_cache_path(vagrantfile_path):
+    '''Return the path to the Ansible fact cache of the machines created
+    from a Vagrantfile. It is in the .vagrant directory next to Vagrantfile.
 
-def validate(vagrantfile_path, playbook_path, **kwargs):
+    vagrantfile_path - path to Vagrantfile
+    '''
+    return join(realpath(vagrantfile_path), '.vagrant', 'doit_facts')
+
+
+def ansible_env(vagrantfile_path, forks=None, mitogen_path=None,
+                cache_facts=False):
+    '''Return the environment variables that tune Ansible runs.
+    They are honored by ansible-playbook, including the one run by the
+    Vagrant provisioner.
+
+    vagrantfile_path - path to Vagrantfile, next to which facts are cached
+    forks - (optional) number of hosts Ansible handles at the same time
+    mitogen_path - (optional) path where Mitogen was extracted,
+                   to use its strategy plugin instead of the default one
+    cache_facts - (optional) cache facts next to Vagrantfile, overriding
+                  the settings of ansible.cfg (see FACT_CACHE_ENV).
+                  Default is False
+    '''
+    env = {}
+    # The settings only make sense together: e.g. a directory is no
+    # connection string for a cache plugin chosen by the user
+    if cache_facts and not any(
+        name.startswith(FACT_CACHE_VARS) for name in environ
+    ):
+        env.update(FACT_CACHE_ENV)
+        env['ANSIBLE_CACHE_PLUGIN_CONNECTION'] = fact_cache_path(
+            vagrantfile_path
+        )
+    if forks is not None:
+        env['ANSIBLE_FORKS'] = str(forks)
+    if mitogen_path:
+        # Ansible runs where Vagrantfile is, not in the current directory
+        env['ANSIBLE_STRATEGY_PLUGINS'] = join(
+            realpath(mitogen_path), MITOGEN_STRATEGY_PLUGINS
+        )
+        env['ANSIBLE_STRATEGY'] = MITOGEN_STRATEGY
+    return env
+
+
+def hash_tree(path, extra_files=()):
+    '''Return a hash of the files under a directory, plus other files.
+    Only their paths, modification times and sizes are read
+    (not their content), so any file written since changes the hash.
+    Hidden directories (like .git and .vagrant) are skipped.
+    Symbolic links to directories (like a role shared between projects)
+    are followed, each directory being read once, so a cycle of links ends.
+    Roles and collections found outside the directory (e.g. through
+    roles_path, or installed by ansible-galaxy) are not covered.
+
+    path - path to the directory
+    extra_files - (optional) paths of other files to include.
+                  Creating or removing one of them also changes the hash
+    '''
+    # Imported here: loading hashlib takes longer than building the parser,
+    # and only the subcommands that validate the playbook need it
+    from hashlib import blake2b
+
+    digest = blake2b()
+    visited = {realpath(path)}
+    pending = [path]
+    while pending:
+        with scandir(pending.pop()) as entries:
+            for entry in sorted(entries, key=lambda entry: entry.path):
+                if entry.is_dir():
+                    if entry.name.startswith('.'):
+                        continue
+                    real_dir = realpath(entry.path)
+                    if real_dir not in visited:
+                        visited.add(real_dir)
+                        pending.append(entry.path)
+                    continue
+                try:
+                    file_stat = entry.stat()
+                except FileNotFoundError:
+                    # Broken symbolic link
+                    continue
+                metadata = (
+                    f'\0{file_stat.st_mtime_ns}\0{file_stat.st_size}\n'
+                )
+                digest.update(fsencode(entry.path) + metadata.encode())
+
+    for extra_file in extra_files:
+        try:
+            file_stat = stat(extra_file)
+            metadata = f'\0{file_stat.st_mtime_ns}\0{file_stat.st_size}\n'
+        except FileNotFoundError:
+            metadata = '\0missing\n'
+        digest.update(fsencode(extra_file) + metadata.encode())
+    return digest.hexdigest()
+
+
+def validate(vagrantfile_path, playbook_path):
     '''Perform validations of Vagrantfile and Ansible Playbooks.
 
     vagrantfile_path - path to Vagrantfile
                        (vagrant commands must be run where Vagrantfile is)
     playbook_path - path to the playbook file
     '''
-    validate_vagrant(vagrantfile_path)
-    validate_ansible(playbook_path)
+    # Both validations are independent, so run them at the same time
+    cmds = [(VAGRANT_VALIDATE_CMD, vagrantfile_path)]
+
+    lint_cmd, lint_passed = ansible_lint_cmd(playbook_path)
+    if lint_cmd:
+        cmds.append((lint_cmd, None))
+
+    run_cmds_and_exit(cmds)
+    if lint_cmd:
+        lint_passed()
 
 
 ##### Vagrant functions #####
 # Define here other useful functions for vagrant
 
 
-def validate_vagrant(vagrantfile_path, **kwargs):
+def validate_vagrant(vagrantfile_path):
     '''Validate Vagrantfile using the "vagrant validate" command.
 
     vagrantfile_path - path to Vagrantfile
@@ -60,7 +362,8 @@ def validate_vagrant(vagrantfile_path, **kwargs):
     run_cmd_and_exit(VAGRANT_VALIDATE_CMD, workdir=vagrantfile_path)
 
 
-def setup(vagrantfile_path, playbook_path, **kwargs):
+def setup(vagrantfile_path, playbook_path, hosts=None, batch_ansible=False,
+          forks=None, mitogen_path=None, cache_facts=False):
     '''Call vagrant to set up a virtual machine, using Ansible to provision it.
     It assumes Vagranfile is configured with the Ansible provisioner.
     Perform some validations before calling vagrant.
@@ -68,252 +371,564 @@ def setup(vagrantfile_path, playbook_path, **kwargs):
     vagrantfile_path - path to Vagrantfile
                        (vagrant commands must be run where Vagrantfile is)
     playbook_path - path to the playbook file
+    hosts - (optional) names of the machines to set up. Default is all
+    batch_ansible - (optional) boot the machines without Vagrant's
+                    provisioner and provision all of them with a single
+                    ansible-playbook run
+    forks - (optional) number of hosts Ansible handles at the same time
+    mitogen_path - (optional) path where Mitogen was extracted
+    cache_facts - (optional) cache Ansible facts next to Vagrantfile
     '''
     validate(vagrantfile_path, playbook_path)
-    run_cmd_and_exit(VAGRANT_UP_CMD, workdir=vagrantfile_path)
-
-
-def status(vagrantfile_path, **kwargs):
+    hosts = list(hosts or [])
+    env = ansible_env(vagrantfile_path, forks, mitogen_path, cache_facts)
+    if batch_ansible:
+        # Install Ansible requirements while the machines boot
+        up_cmd = [*VAGRANT_UP_CMD, '--no-provision', *hosts]
+        cmds = [(up_cmd, vagrantfile_path)]
+        galaxy_cmd = requirements_cmd(playbook_path)
+        if galaxy_cmd:
+            cmds.append((galaxy_cmd, vagrantfile_path))
+        run_cmds_and_exit(cmds)
+        provision_all(
+            vagrantfile_path, playbook_path, hosts, env=env,
+            install_requirements=False
+        )
+    else:
+        cmd = [*VAGRANT_UP_CMD, *hosts]
+        run_cmd_and_exit(cmd, workdir=vagrantfile_path, env=env)
+
+
+def status(vagrantfile_path):
     '''Show the status of virtual machine created by Vagrant.
+    It replaces the current process with vagrant, so it never returns.
 
     vagrantfile_path - path to Vagrantfile
                        (vagrant commands must be run where Vagrantfile is)
     '''
-    run_cmd_and_exit(VAGRANT_STATUS_CMD, workdir=vagrantfile_path)
+    run_cmd_and_exec(VAGRANT_STATUS_CMD, workdir=vagrantfile_path)
 
 
-def enter(vagrantfile_path, **kwargs):
+def enter(vagrantfile_path):
     '''Open an SSH connection to a previously created VM.
+    It replaces the current process with vagrant, so it never returns.
 
     vagrantfile_path - path to Vagrantfile
                        (vagrant commands must be run where Vagrantfile is)
     '''
-    run_cmd_and_exit(VAGRANT_SSH_CMD, workdir=vagrantfile_path)
+    run_cmd_and_exec(VAGRANT_SSH_CMD, workdir=vagrantfile_path)
 
 
-def reprovision(vagrantfile_path, playbook_path, **kwargs):
+def reprovision(vagrantfile_path, playbook_path, hosts=None,
+                batch_ansible=False, forks=None, mitogen_path=None,
+                cache_facts=False):
     '''Call ansible to provision the machine again.
     Perform some validations before calling vagrant.
 
     vagrantfile_path - path to Vagrantfile
                        (vagrant commands must be run where Vagrantfile is)
     playbook_path - path to the playbook file
+    hosts - (optional) names of the machines to provision. Default is all
+    batch_ansible - (optional) provision all machines with a single
+                    ansible-playbook run instead of one Vagrant
+                    provisioner per VM
+    forks - (optional) number of hosts Ansible handles at the same time
+    mitogen_path - (optional) path where Mitogen was extracted
+    cache_facts - (optional) cache Ansible facts next to Vagrantfile
     '''
     validate(vagrantfile_path, playbook_path)
-    run_cmd_and_exit(VAGRANT_REPROVISION_CMD, workdir=vagrantfile_path)
+    hosts = list(hosts or [])
+    env = ansible_env(vagrantfile_path, forks, mitogen_path, cache_facts)
+    if batch_ansible:
+        provision_all(vagrantfile_path, playbook_path, hosts, env=env)
+    else:
+        cmd = [*VAGRANT_REPROVISION_CMD, *hosts]
+        run_cmd_and_exit(cmd, workdir=vagrantfile_path, env=env)
 
 
-def destroy(vagrantfile_path, **kwargs):
+def destroy(vagrantfile_path):
     '''Destroy a VM created by Vagrant.
+    The cached Ansible facts are removed first, so a new VM gets its own.
+    It replaces the current process with vagrant, so it never returns.
 
     vagrantfile_path - path to Vagrantfile
                        (vagrant commands must be run where Vagrantfile is)
     '''
-    run_cmd_and_exit(VAGRANT_DESTROY_CMD, workdir=vagrantfile_path)
+    from shutil import rmtree
+
+    rmtree(fact_cache_path(vagrantfile_path), ignore_errors=True)
+    run_cmd_and_exec(VAGRANT_DESTROY_CMD, workdir=vagrantfile_path)
 
 
 ##### Ansible functions #####
 # Define here other useful functions for ansible
 
 
-def validate_ansible(playbook_path, **kwargs):
+def write_inventory(vagrantfile_path, hosts=None):
+    '''Write an Ansible inventory with the machines created by Vagrant.
+    SSH settings of each machine come from "vagrant ssh-config".
+    Both files are written in the .vagrant directory next to Vagrantfile.
+    Return the absolute path to the inventory file.
+
+    vagrantfile_path - path to Vagrantfile
+                       (vagrant commands must be run where Vagrantfile is)
+    hosts - (optional) names of the machines to include. Default is all
+    '''
+    vagrant_dir = join(realpath(vagrantfile_path), '.vagrant')
+    ssh_config_path = join(vagrant_dir, 'doit_ssh_config')
+    inventory_path = join(vagrant_dir, 'doit_inventory')
+
+    # Vagrant creates it on its first command, which may not have happened
+    # yet. "vagrant ssh-config" then reports that no machine was created
+    makedirs(vagrant_dir, exist_ok=True)
+
+    with open(ssh_config_path, 'w') as ssh_config:
+        run(
+            [*VAGRANT_SSH_CONFIG_CMD, *(hosts or [])], check=True,
+            cwd=vagrantfile_path, env=cmd_env(), stdout=ssh_config
+        )
+
+    with open(ssh_config_path) as ssh_config:
+        names = [
+            line.split()[1] for line in ssh_config if line.startswith('Host ')
+        ]
+
+    with open(inventory_path, 'w') as inventory:
+        for name in names:
+            inventory.write(
+                f'{name} ansible_ssh_common_args=\'-F "{ssh_config_path}"\'\n'
+            )
+
+    return inventory_path
+
+
+def requirements_cmd(playbook_path):
+    '''Return the command installing the collections and roles listed in
+    requirements.yml (next to the playbook), as the Vagrant provisioner does.
+    Return None if there is no such file.
+
+    playbook_path - path to the playbook file
+    '''
+    requirements_path = join(
+        dirname(realpath(playbook_path)), 'requirements.yml'
+    )
+    if not isfile(requirements_path):
+        return None
+    return [*ANSIBLE_GALAXY_CMD, requirements_path]
+
+
+def provision_all(vagrantfile_path, playbook_path, hosts=None, env=None,
+                  install_requirements=True):
+    '''Provision the machines created by Vagrant with a single
+    ansible-playbook run, so Ansible handles all of them at once instead of
+    Vagrant running its provisioner one machine after another.
+    Like the Vagrant provisioner, Ansible is run where Vagrantfile is,
+    so an ansible.cfg there is honored.
+
+    vagrantfile_path - path to Vagrantfile
+                       (vagrant commands must be run where Vagrantfile is)
+    playbook_path - path to the playbook file
+    hosts - (optional) names of the machines to provision. Default is all
+    env - (optional) variables to add to the environment of ansible-playbook
+    install_requirements - (optional) install collections and roles from
+                           requirements.yml first. Default is True
+    '''
+    galaxy_cmd = requirements_cmd(playbook_path)
+    if install_requirements and galaxy_cmd:
+        run_cmd_and_exit(galaxy_cmd, workdir=vagrantfile_path)
+
+    inventory_path = write_inventory(vagrantfile_path, hosts)
+    cmd = [
+        *ANSIBLE_PLAYBOOK_CMD, '-i', inventory_path, realpath(playbook_path)
+    ]
+    run_cmd_and_exit(cmd, workdir=vagrantfile_path, env=env)
+
+
+def lint_extra_files(playbook_dir):
+    '''Return the files besides the playbook directory that change the
+    result of ansible-lint: its configuration files (in the current
+    directory, the playbook directory and its parents) and its executable,
+    which changes when ansible-lint is upgraded.
+
+    playbook_dir - resolved path to the directory of the playbook
+    '''
+    from shutil import which
+
+    config_dirs = [playbook_dir]
+    while dirname(config_dirs[-1]) != config_dirs[-1]:
+        config_dirs.append(dirname(config_dirs[-1]))
+    if _CWD not in config_dirs:
+        config_dirs.append(_CWD)
+
+    extra_files = [
+        join(config_dir, config_file)
+        for config_dir in config_dirs
+        for config_file in ANSIBLE_LINT_CONFIG_FILES
+    ]
+
+    executable = which(ANSIBLE_LINT_CMD[0])
+    if executable:
+        extra_files.append(realpath(executable))
+    return extra_files
+
+
+def lint_cache_entry(playbook_path):
+    '''Return the path to the file keeping the last ansible-lint result of
+    a playbook, and the current hash of the playbook directory (which
+    includes its variables, roles and requirements), together with the
+    ansible-lint configuration and executable.
+    The playbook path is resolved once for both.
+
+    playbook_path - path to the playbook file
+    '''
+    from hashlib import blake2b
+
+    resolved_path = realpath(playbook_path)
+    name = blake2b(fsencode(resolved_path), digest_size=16)
+    cache_path = join(ANSIBLE_LINT_CACHE_DIR, name.hexdigest())
+
+    playbook_dir = dirname(resolved_path)
+    tree_hash = hash_tree(playbook_dir, lint_extra_files(playbook_dir))
+    return cache_path, tree_hash
+
+
+def is_lint_cached(cache_path, tree_hash):
+    '''Check whether ansible-lint already passed for a playbook when its
+    directory had the given hash.
+
+    cache_path - path returned by lint_cache_entry
+    tree_hash - current hash of the playbook directory
+    '''
+    try:
+        with open(cache_path) as cache:
+            return cache.read() == tree_hash
+    except OSError:
+        return False
+
+
+def store_lint_cache(cache_path, tree_hash):
+    '''Record that ansible-lint passed for a playbook.
+    The cache file is replaced atomically.
+
+    cache_path - path returned by lint_cache_entry
+    tree_hash - hash of the playbook directory when ansible-lint was run
+    '''
+    makedirs(ANSIBLE_LINT_CACHE_DIR, exist_ok=True)
+    with open(f'{cache_path}.tmp', 'w') as cache:
+        cache.write(tree_hash)
+    replace(f'{cache_path}.tmp', cache_path)
+
+
+def ansible_lint_cmd(playbook_path):
+    '''Return the ansible-lint command validating a playbook, and a function
+    to call once that command passes, which records it in the cache.
+    Return (None, None) if ansible-lint already passed and nothing it
+    depends on has changed since.
+
+    playbook_path - path to the playbook file
+    '''
+    cache_path, tree_hash = lint_cache_entry(playbook_path)
+    if is_lint_cached(cache_path, tree_hash):
+        return None, None
+
+    def lint_passed():
+        store_lint_cache(cache_path, tree_hash)
+
+    return [*ANSIBLE_LINT_CMD, playbook_path], lint_passed
+
+
+def validate_ansible(playbook_path):
     '''Validate a Ansible Playbook file using ansible-lint.
     It does not access encrypted values (Vault).
+    ansible-lint is skipped if it already passed and no file in the playbook
+    directory has changed since.
 
     playbook_path - path to the playbook file
     '''
-    cmd = ANSIBLE_LINT_CMD + [playbook_path]
-    run_cmd_and_exit(cmd)
+    cmd, lint_passed = ansible_lint_cmd(playbook_path)
+    if cmd:
+        run_cmd_and_exit(cmd)
+        lint_passed()
 
 
-def encrypt_vault(vault_file_path, **kwargs):
-    '''Encrypt a file with ansible-vault.
+def vault_cmd(action, vault_file_paths):
+    '''Return the ansible-vault command performing an action on files.
+
+    action - ansible-vault action (encrypt, edit, view or rekey)
+    vault_file_paths - absolute or relative paths to the files.
+                       A single path may be given as a string
+    '''
+    if isinstance(vault_file_paths, (str, bytes, PathLike)):
+        vault_file_paths = [vault_file_paths]
+    return [*ANSIBLE_VAULT_CMD, action, *vault_file_paths]
+
+
+def encrypt_vault(vault_file_paths):
+    '''Encrypt files with ansible-vault.
     It will request you a password.
 
-    vault_file_path - absolute or relative path to the file
+    vault_file_paths - absolute or relative paths to the files (or one path)
     '''
-    cmd = ANSIBLE_VAULT_CMD + ['encrypt', vault_file_path]
+    cmd = vault_cmd('encrypt', vault_file_paths)
     run_cmd_and_exit(cmd)
 
 
-def edit_vault(vault_file_path, **kwargs):
-    '''Edit a file encrypted by ansible-vault.
+def edit_vault(vault_file_paths):
+    '''Edit files encrypted by ansible-vault, one after the other.
     It will request you a password.
 
-    vault_file_path - absolute or relative path to the file
+    vault_file_paths - absolute or relative paths to the files (or one path)
     '''
-    cmd = ANSIBLE_VAULT_CMD + ['edit', vault_file_path]
+    cmd = vault_cmd('edit', vault_file_paths)
     run_cmd_and_exit(cmd)
 
 
-def view_vault(vault_file_path, **kwargs):
-    '''Open and show a file encrypted by ansible-vault.
+def view_vault(vault_file_paths):
+    '''Open and show files encrypted by ansible-vault.
     It will request you a password.
 
-    vault_file_path - absolute or relative path to the file
+    vault_file_paths - absolute or relative paths to the files (or one path)
     '''
-    cmd = ANSIBLE_VAULT_CMD + ['view', vault_file_path]
+    cmd = vault_cmd('view', vault_file_paths)
     run_cmd_and_exit(cmd)
 
 
-def rekey_vault(vault_file_path, **kwargs):
-    '''Change the key used to encrypt a file using ansible-vault.
+def rekey_vault(vault_file_paths):
+    '''Change the key used to encrypt files using ansible-vault.
     It will request you two passwords: the old password and the new one.
 
-    vault_file_path - absolute or relative path to the file
+    vault_file_paths - absolute or relative paths to the files (or one path)
     '''
-    cmd = ANSIBLE_VAULT_CMD + ['rekey', vault_file_path]
+    cmd = vault_cmd('rekey', vault_file_paths)
     run_cmd_and_exit(cmd)
 
 
 ##### Argument Parser functions #####
 
 
+def positive_int(value):
+    '''Convert a command line value to an integer greater than zero.
+
+    value - string given on the command line
+    '''
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError(
+            f'must be an integer greater than zero, not {value!r}'
+        )
+    return number
+
+
 def add_argument_vagrantfile(parser):
-    default_vagrantfile_path = realpath('.')
     parser.add_argument(
-        '--vagrantfile-path', '-f', type=str, default=default_vagrantfile_path,
+        '--vagrantfile-path', '-f', type=str, default=_CWD,
         help='Path to Vagrantfile. Default is the current directory.'
     )
 
 
 def add_argument_playbook(parser):
-    # Default path to the playbook is provisioning/playbook.yml in the current dir
-    default_vagrantfile_path = realpath('.')
-    default_playbook_path = join(
-        default_vagrantfile_path, 'provisioning', 'playbook.yml'
+    parser.add_argument(
+        '--playbook-path', '-p', type=str, default=_DEFAULT_PLAYBOOK,
+        help=f'Path to the playbook file. Default is {_DEFAULT_PLAYBOOK}.'
+    )
+
+
+def add_argument_hosts(parser):
+    parser.add_argument(
+        '--hosts', nargs='+', metavar='HOST',
+        help='Names of the machines defined in Vagrantfile. Default is all.'
+    )
+
+
+def add_argument_batch_ansible(parser):
+    parser.add_argument(
+        '--batch-ansible', action='store_true',
+        help='Skip the Vagrant provisioner and provision all machines '
+             'with a single ansible-playbook run.'
     )
+
+
+def add_argument_forks(parser):
     parser.add_argument(
-        '--playbook-path', '-p', type=str, default=default_playbook_path,
-        help=f'Path to the playbook file. Default is {default_playbook_path}.'
+        '--forks', type=positive_int,
+        help='Number of machines Ansible provisions at the same time.'
+    )
+
+
+def add_argument_cache_facts(parser):
+    parser.add_argument(
+        '--cache-facts', action='store_true',
+        help='Cache Ansible facts for an hour next to Vagrantfile. '
+             'It overrides the fact gathering and caching settings '
+             'of ansible.cfg.'
+    )
+
+
+def add_argument_mitogen(parser):
+    parser.add_argument(
+        '--mitogen-path', type=str,
+        help='Path where Mitogen was extracted. '
+             'If set, Ansible uses the Mitogen strategy.'
     )
 
 
 def add_argument_vault_file(parser):
     parser.add_argument(
-        '--vault-file-path', '-f', type=str, required=True,
-        help='Path to file to be encrypted/descrypted using ansible-vault.'
+        '--vault-file-path', '-f', type=str, required=True, nargs='+',
+        dest='vault_file_paths', metavar='VAULT_FILE_PATH',
+        help='Paths to files to be encrypted/descrypted using ansible-vault.'
     )
 
 
 def add_subparser_to_vagrant_command(
-    subparsers, name, description, include_playbook=False
+    subparsers, name, description, func, include_playbook=False,
+    include_hosts=False
 ):
     parser = subparsers.add_parser(
         name, help=description, description=description
     )
+    parser.set_defaults(func=func)
     add_argument_vagrantfile(parser)
 
     if include_playbook:
         add_argument_playbook(parser)
 
-    return parser
+    if include_hosts:
+        add_argument_hosts(parser)
+        add_argument_batch_ansible(parser)
+        add_argument_forks(parser)
+        add_argument_cache_facts(parser)
+        add_argument_mitogen(parser)
 
-    parser_edit_vault = add_subparser_to_vault_command(
-        subparsers, 'edit_vault', desc
-    )
+    return parser
 
 
 def add_subparser_to_vault_command(
-    subparsers, name, description
+    subparsers, name, description, func
 ):
     parser = subparsers.add_parser(
         name, help=description, description=description
     )
+    parser.set_defaults(func=func)
     add_argument_vault_file(parser)
 
     return parser
 
 
-def create_subparsers(subparsers):
+def create_subparsers(subparsers, only=None):
+    '''Add a subparser for each subcommand.
+
+    subparsers - object returned by ArgumentParser.add_subparsers
+    only - (optional) name of the only subcommand to add. Default is all
+    '''
     # Task: vagrant up
-    desc = f'Create and provision a virtual machine '
-    desc += f'({" ".join(VAGRANT_UP_CMD)}).'
-    add_subparser_to_vagrant_command(
-        subparsers, 'setup', desc, include_playbook=True
-    )
+    if only in (None, 'setup'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'setup', DESC_SETUP, setup, include_playbook=True,
+            include_hosts=True
+        )
 
     # Task: vagrant status
-    desc = 'Show the status of virtual machine '
-    desc += f'({" ".join(VAGRANT_STATUS_CMD)}).'
-    add_subparser_to_vagrant_command(
-        subparsers, 'status', desc
-    )
+    if only in (None, 'status'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'status', DESC_STATUS, status
+        )
 
     # Task: vagrant ssh
-    desc = 'Open an SSH connection to virtual machine '
-    desc += f'({" ".join(VAGRANT_SSH_CMD)}).'
-    add_subparser_to_vagrant_command(
-        subparsers, 'enter', desc
-    )
+    if only in (None, 'enter'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'enter', DESC_ENTER, enter
+        )
 
     # Task: vagrant provision
-    desc = '(Re)Provision an existing virtual machine '
-    desc += f'({" ".join(VAGRANT_REPROVISION_CMD)}).'
-    add_subparser_to_vagrant_command(
-        subparsers, 'reprovision', desc, include_playbook=True
-    )
+    if only in (None, 'reprovision'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'reprovision', DESC_REPROVISION, reprovision,
+            include_playbook=True, include_hosts=True
+        )
 
     # Task: vagrant destroy
-    desc = 'Destroy running virtual machine '
-    desc += f'({" ".join(VAGRANT_DESTROY_CMD)}).'
-    add_subparser_to_vagrant_command(
-        subparsers, 'destroy', desc
-    )
+    if only in (None, 'destroy'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'destroy', DESC_DESTROY, destroy
+        )
 
     # Task: vagrant validate + ansible-lint
-    desc = 'Validate Vagrantfile and Ansible Playbook.'
-    add_subparser_to_vagrant_command(
-        subparsers, 'validate', desc, include_playbook=True
-    )
+    if only in (None, 'validate'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'validate', DESC_VALIDATE, validate,
+            include_playbook=True
+        )
 
     # Task: vagrant validate
-    desc = 'Validate Vagrantfile '
-    desc += f'({" ".join(VAGRANT_VALIDATE_CMD)}).'
-    add_subparser_to_vagrant_command(
-        subparsers, 'validate_vagrant', desc
-    )
+    if only in (None, 'validate_vagrant'):
+        add_subparser_to_vagrant_command(
+            subparsers, 'validate_vagrant', DESC_VALIDATE_VAGRANT,
+            validate_vagrant
+        )
 
     # Task: ansible-lint
-    desc = 'Validate Ansible Playbook '
-    desc += f'({" ".join(ANSIBLE_LINT_CMD)}).'
-    parser = subparsers.add_parser(
-        'validate_playbook', help=desc, description=desc,
-    )
-    add_argument_playbook(parser)
+    if only in (None, 'validate_playbook'):
+        parser = subparsers.add_parser(
+            'validate_playbook', help=DESC_VALIDATE_PLAYBOOK,
+            description=DESC_VALIDATE_PLAYBOOK,
+        )
+        parser.set_defaults(func=validate_ansible)
+        add_argument_playbook(parser)
 
     # Task: ansible-vault encrypt
-    desc = 'Encrypt a file with Ansible Vault '
-    desc += f'({" ".join(ANSIBLE_VAULT_CMD)}).'
-    add_subparser_to_vault_command(
-        subparsers, 'encrypt_vault', desc
-    )
+    if only in (None, 'encrypt_vault'):
+        add_subparser_to_vault_command(
+            subparsers, 'encrypt_vault', DESC_ENCRYPT_VAULT, encrypt_vault
+        )
 
     # Task: ansible-vault edit
-    desc = 'Edit a file encrypted by Ansible Vault '
-    desc += f'({" ".join(ANSIBLE_VAULT_CMD)}).'
-    add_subparser_to_vault_command(
-        subparsers, 'edit_vault', desc
-    )
+    if only in (None, 'edit_vault'):
+        add_subparser_to_vault_command(
+            subparsers, 'edit_vault', DESC_EDIT_VAULT, edit_vault
+        )
 
     # Task: ansible-vault view
-    desc = 'Show the content of a file encrypted by Ansible Vault '
-    desc += f'({" ".join(ANSIBLE_VAULT_CMD)}).'
-    add_subparser_to_vault_command(
-        subparsers, 'view_vault', desc
-    )
+    if only in (None, 'view_vault'):
+        add_subparser_to_vault_command(
+            subparsers, 'view_vault', DESC_VIEW_VAULT, view_vault
+        )
 
     # Task: ansible-vault rekey
-    desc = 'Change the key used to encrypt a file using Ansible Vault '
-    desc += f'({" ".join(ANSIBLE_VAULT_CMD)}).'
-    add_subparser_to_vault_command(
-        subparsers, 'rekey_vault', desc
-    )
+    if only in (None, 'rekey_vault'):
+        add_subparser_to_vault_command(
+            subparsers, 'rekey_vault', DESC_REKEY_VAULT, rekey_vault
+        )
 
 
 ##### Main function #####
 
 
+# Arguments passed to the function of each subcommand (see create_subparsers),
+# in the order of its parameters
+_PROVISION_ARGS = (
+    'vagrantfile_path', 'playbook_path', 'hosts', 'batch_ansible', 'forks',
+    'mitogen_path', 'cache_facts',
+)
+SIGNATURES = {
+    'setup': _PROVISION_ARGS,
+    'status': ('vagrantfile_path',),
+    'enter': ('vagrantfile_path',),
+    'reprovision': _PROVISION_ARGS,
+    'destroy': ('vagrantfile_path',),
+    'validate': ('vagrantfile_path', 'playbook_path'),
+    'validate_vagrant': ('vagrantfile_path',),
+    'validate_playbook': ('playbook_path',),
+    'encrypt_vault': ('vault_file_paths',),
+    'edit_vault': ('vault_file_paths',),
+    'view_vault': ('vault_file_paths',),
+    'rekey_vault': ('vault_file_paths',),
+}
+
+
 def main():
     '''Main function parses command line and other call functions'''
 
@@ -329,7 +944,12 @@ def main():
         help='Choose one subcommand to perform the action.',
         dest='subcommand'
     )
-    create_subparsers(subparsers)
+    # Only the chosen subcommand needs a subparser. Build all of them if it
+    # is missing or unknown, so argparse can list them in its messages
+    chosen = sys.argv[1] if len(sys.argv) > 1 else None
+    create_subparsers(
+        subparsers, only=chosen if chosen in SIGNATURES else None
+    )
 
     # Parse arguments and return a Namespace object
     # https://docs.python.org/3/library/argparse.html#the-parse-args-method
@@ -338,15 +958,11 @@ def main():
     if args.subcommand is None:
         parser.error('You must choose a subcommand!')
 
-    # Put all arguments into a dictionary
-    all_arguments = vars(args)
+    # Put the arguments of the chosen task in the order its function expects
+    arguments = [getattr(args, name) for name in SIGNATURES[args.subcommand]]
 
-    try:
-        # Try to call the function related to the chosen task
-        eval(f'{args.subcommand}(**all_arguments)')
-    except NameError:
-        parser.error(
-            f'Subcommand {args.subcommand} has not been implemented yet.')
+    # Call the function related to the chosen task (see create_subparsers)
+    args.func(*arguments)
 
 
 if __name__ == "__main__":